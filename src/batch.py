@@ -0,0 +1,132 @@
+# ----------------------------- batch.py -----------------------------
+"""
+Multi-region batch runner
+Input : manifest (YAML) – one job per region / customer workbook
+Output: <out_root>/<tenant>/{visits.parquet, visit_scores.csv, sp_metrics.csv}
+        <out_root>/batch_summary.csv  – one row per job
+
+Jobs run in a bounded process pool.  Workers are forked from a parent that
+has already imported pandas / sklearn / pyarrow / openpyxl, and each worker
+is reused for many jobs, so import cost is paid once instead of per job.
+
+Manifest format
+---------------
+jobs:
+  - tenant: texnl
+    input:  data/raw/TexNL_Data.xlsx        # Excel → ETL is run first
+  - tenant: utrecht
+    in_pq:  data/processed/utrecht.parquet  # already-built visits parquet
+    contamination: 0.03                     # optional per-job overrides
+    backend: polars                         # pandas (default) | polars
+"""
+import argparse, os, sys, time, yaml
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# heavy imports happen here, in the parent, so forked workers inherit them
+import pandas as pd
+import openpyxl, pyarrow  # noqa: F401  (pre-load for ETL / parquet IO)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from etl.texnl_anomaly_etl import run_etl
+import infer
+
+
+# -------------------------------------------------------------------------
+def _init_worker():
+    """
+    Load the heavy modules once per worker.  Under fork they are already
+    inherited from the parent; under spawn this pays the imports once per
+    worker instead of once per job.
+    """
+    import pandas, pyarrow, openpyxl, sklearn.ensemble  # noqa: F401
+
+
+def run_job(job: dict, out_root: str, defaults: dict) -> dict:
+    """ETL (if needed) → scoring → build_sp for a single tenant."""
+    tenant = job["tenant"]
+    out_dir = Path(out_root) / tenant
+    out_dir.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+
+    contamination = job.get("contamination", defaults["contamination"])
+    n_estimators  = job.get("n_estimators",  defaults["n_estimators"])
+    backend       = job.get("backend", "pandas")
+
+    in_pq = job.get("in_pq")
+    if in_pq is None:
+        in_pq = out_dir / "visits.parquet"
+        run_etl(job["input"], in_pq, backend)
+
+    df_vis, sp = infer.main(in_pq, contamination, n_estimators,
+                            out_dir, defaults["n_jobs"], backend=backend)
+    return {
+        "tenant":              tenant,
+        "status":              "ok",
+        "visits":              len(df_vis),
+        "service_points":      len(sp),
+        "anomalous_visits":    int(df_vis["is_anomaly"].sum()),
+        "anomalous_sp":        int((sp["Anomaly State"] == "Yes").sum()),
+        "seconds":             round(time.perf_counter() - t0, 2),
+        "out_dir":             str(out_dir),
+        "error":               "",
+    }
+
+
+def _safe_job(job, out_root, defaults):
+    try:
+        return run_job(job, out_root, defaults)
+    except Exception as e:  # one bad workbook must not kill the batch
+        return {"tenant": job.get("tenant"), "status": "failed",
+                "error": f"{type(e).__name__}: {e}"}
+
+
+# -------------------------------------------------------------------------
+def main(manifest: str, out_root="output", workers=None,
+         contamination=0.05, n_estimators=400):
+    jobs = yaml.safe_load(open(manifest))["jobs"]
+    tenants = [j["tenant"] for j in jobs]
+    if len(set(tenants)) != len(tenants):
+        raise ValueError("tenant names in the manifest must be unique")
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    defaults = {
+        "contamination": contamination,
+        "n_estimators":  n_estimators,
+        # split the cores between workers instead of oversubscribing
+        "n_jobs":        max(1, (os.cpu_count() or 1) // workers),
+    }
+
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker) as pool:
+        futs = [pool.submit(_safe_job, j, out_root, defaults) for j in jobs]
+        for f in as_completed(futs):
+            r = f.result()
+            print(f"  [{r['status']}] {r['tenant']} {r['error']}")
+            rows.append(r)
+
+    summary = pd.DataFrame(rows).set_index("tenant").loc[tenants].reset_index()
+    # failed jobs have no counts; keep the columns integer instead of float
+    int_cols = ["visits", "service_points", "anomalous_visits", "anomalous_sp"]
+    summary[int_cols] = summary.reindex(columns=int_cols).astype("Int64")
+    Path(out_root).mkdir(parents=True, exist_ok=True)
+    summary.to_csv(Path(out_root) / "batch_summary.csv", index=False)
+    n_ok = int((summary["status"] == "ok").sum())
+    print(f"✅ {n_ok}/{len(jobs)} jobs done → {Path(out_root) / 'batch_summary.csv'}")
+    return summary
+
+
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--manifest", required=True)
+    p.add_argument("--out_root", default="output")
+    p.add_argument("--workers",  type=int, default=None)
+    p.add_argument("--contam",   type=float, default=0.05)
+    p.add_argument("--n_estimators", type=int, default=400)
+    args = p.parse_args()
+    main(args.manifest, args.out_root, args.workers,
+         args.contam, args.n_estimators)
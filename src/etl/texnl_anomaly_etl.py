@@ -3,8 +3,25 @@
 ETL + feature engineering
 Input : Excel (Task Record · Service Points · Assets)
 Output: visits.parquet  – one row per visit, incl. latitude / longitude
+
+Backends
+    pandas – eager chain (default)
+    polars – the same steps as one lazy, multi-threaded query plan; the
+             sheets are still parsed by pandas/openpyxl, everything after
+             that is never materialised until the final collect()
+
+Sharded mode (--shards N)
+    The daily-aggregated task records are hash-partitioned by service_point
+    and the per-SP features are computed in a process pool; every worker
+    writes its shard straight to <out>/part-XXXXX.parquet, so the output is
+    a parquet dataset directory (pd.read_parquet(<out>) reads it whole) and
+    no single process ever concatenates the full visit table.  Workers are
+    forked and slice the parent's aggregated frame by row index, so no shard
+    is pickled.  Pandas backend only.
 """
-import argparse
+import argparse, os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import pandas as pd
 import numpy as np
@@ -15,8 +32,11 @@ COL_SP_CANDIDATES_SP = {
     "Service point", "service_point", "Name"
 }
 
+BACKENDS = ("pandas", "polars")
+
 # -------------------------------------------------------------------------
-def run_etl(input_xlsx: str, out_pq: str):
+def load_sheets(input_xlsx: str):
+    """Task Record, Assets and the SP geo table (service_point, lat, lon)."""
     xlsx = pd.ExcelFile(input_xlsx, engine="openpyxl")
 
     # ---------- load sheets ----------
@@ -33,7 +53,12 @@ def run_etl(input_xlsx: str, out_pq: str):
                                         lat_col: "lat",
                                         lon_col: "lon"})
     sp_geo = sp_sheet[["service_point", "lat", "lon"]]
+    return tasks, assets, sp_geo
 
+# -------------------------------------------------------------------------
+def aggregate_visits(tasks: pd.DataFrame, assets: pd.DataFrame,
+                     sp_geo: pd.DataFrame) -> pd.DataFrame:
+    """Task records → one row per (service point, day) with capacity & geo."""
     # ---------- clean Task table ----------
     tasks = tasks[tasks["Material"].str.contains("Bag Weight", na=False)].copy()
     tasks["visit_date"] = pd.to_datetime(tasks["Date"]).dt.date
@@ -56,7 +81,10 @@ def run_etl(input_xlsx: str, out_pq: str):
     )
 
     df["V_fill"] = df["V_kg"] / df["capacity_kg"]
+    return df
 
+def add_interval_features(df: pd.DataFrame) -> pd.DataFrame:
+    """VI, GR and rolling V_kg stats; every feature is local to one SP."""
     # ---------- interval features ----------
     df["visit_date"] = pd.to_datetime(df["visit_date"])
     df = df.sort_values(["service_point", "visit_date"])
@@ -75,6 +103,117 @@ def run_etl(input_xlsx: str, out_pq: str):
         df.groupby("service_point")["V_kg"]
           .transform(lambda s: s.rolling(6, min_periods=1).std().fillna(0))
     )
+    return df
+
+def build_visits(tasks: pd.DataFrame, assets: pd.DataFrame,
+                 sp_geo: pd.DataFrame) -> pd.DataFrame:
+    return add_interval_features(aggregate_visits(tasks, assets, sp_geo))
+
+# -------------------------------------------------------------------------
+_VISITS = None   # aggregated visits of run_etl_sharded, inherited on fork
+
+def _write_shard(rows: np.ndarray, path: str, shard: pd.DataFrame = None) -> int:
+    """Features for one shard; forked workers slice the inherited frame."""
+    if shard is None:
+        shard = _VISITS.iloc[rows]
+    add_interval_features(shard.copy()).to_parquet(path, index=False)
+    return len(shard)
+
+def run_etl_sharded(input_xlsx: str, out_dir: str, n_shards: int,
+                    workers: int = None):
+    global _VISITS
+    tasks, assets, sp_geo = load_sheets(input_xlsx)
+    df = aggregate_visits(tasks, assets, sp_geo)
+    del tasks
+
+    # stable hash → the same SP always lands in the same part
+    shard_id = pd.util.hash_array(df["service_point"].to_numpy(dtype=object)) % n_shards
+    parts = [(k, np.flatnonzero(shard_id == k)) for k in np.unique(shard_id)]
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old in out_dir.glob("part-*.parquet"):
+        old.unlink()
+
+    # forked workers read the parent's frame copy-on-write and only receive
+    # row indices; without fork each worker is sent its own slice
+    fork = "fork" in mp.get_all_start_methods()
+    ctx = mp.get_context("fork") if fork else None
+    _VISITS = df
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 mp_context=ctx) as pool:
+            futs = [pool.submit(_write_shard, rows,
+                                str(out_dir / f"part-{k:05d}.parquet"),
+                                None if fork else df.iloc[rows])
+                    for k, rows in parts]
+            n_rows = sum(f.result() for f in futs)
+    finally:
+        _VISITS = None
+    print(f"✅ {n_rows} visits in {len(futs)} shards written → {out_dir}")
+
+# -------------------------------------------------------------------------
+def build_visits_polars(tasks: pd.DataFrame, assets: pd.DataFrame,
+                        sp_geo: pd.DataFrame) -> pd.DataFrame:
+    """Same features as build_visits, as a single lazy Polars plan."""
+    try:
+        import polars as pl
+    except ImportError as e:
+        raise ImportError("backend 'polars' needs `pip install polars`") from e
+
+    sp = "service_point"
+    # mixed Excel date cells are parsed with pandas' rules, as in build_visits;
+    # footer rows ("Total" …) are coerced to NaT and dropped by the filter
+    tasks = tasks[["Material", "Date", "Service Point", "Actual Amount (Item)"]]
+    tasks = tasks.assign(Date=pd.to_datetime(tasks["Date"], errors="coerce"))
+    tasks_lf = (
+        pl.from_pandas(tasks).lazy()
+          .filter(pl.col("Material").cast(pl.Utf8)
+                    .str.contains("Bag Weight", literal=True).fill_null(False))
+          .select(pl.col("Service Point").alias(sp),
+                  pl.col("Date").dt.date().alias("visit_date"),
+                  pl.col("Actual Amount (Item)").cast(pl.Float64).alias("V_kg"))
+    )
+    cap_lf = (
+        pl.from_pandas(assets[["Location Details", "Weight Capacity"]]).lazy()
+          .select(pl.col("Location Details").alias(sp),
+                  pl.col("Weight Capacity").cast(pl.Float64).alias("capacity_kg"))
+          .group_by(sp).agg(pl.col("capacity_kg").sum())
+    )
+    geo_lf = pl.from_pandas(sp_geo).lazy()
+
+    out = (
+        tasks_lf.group_by([sp, "visit_date"]).agg(pl.col("V_kg").sum())
+          .join(cap_lf, on=sp, how="left")
+          .join(geo_lf, on=sp, how="left")
+          .drop_nulls("capacity_kg")
+          .with_columns(pl.col("visit_date").cast(pl.Datetime("ns")),
+                        (pl.col("V_kg") / pl.col("capacity_kg")).alias("V_fill"))
+          .sort([sp, "visit_date"])
+          .with_columns(
+              pl.col("visit_date").diff().dt.total_days().cast(pl.Float64)
+                .over(sp).alias("VI"),
+              pl.col("V_kg").rolling_mean(6, min_samples=1)
+                .over(sp).alias("V_kg_mean"),
+              pl.col("V_kg").rolling_std(6, min_samples=1)
+                .over(sp).fill_null(0).fill_nan(0).alias("V_kg_std"),
+          )
+          .with_columns(pl.when(pl.col("VI") != 0).then(pl.col("VI")).alias("VI"))
+          .with_columns((pl.col("V_kg") / pl.col("VI")).alias("GR"))
+          .select([sp, "visit_date", "V_kg", "capacity_kg", "lat", "lon",
+                   "V_fill", "VI", "GR", "V_kg_mean", "V_kg_std"])
+    )
+    return out.collect().to_pandas()
+
+# -------------------------------------------------------------------------
+def run_etl(input_xlsx: str, out_pq: str, backend: str = "pandas"):
+    tasks, assets, sp_geo = load_sheets(input_xlsx)
+    if backend == "polars":
+        df = build_visits_polars(tasks, assets, sp_geo)
+    elif backend == "pandas":
+        df = build_visits(tasks, assets, sp_geo)
+    else:
+        raise ValueError(f"unknown backend '{backend}', expected one of {BACKENDS}")
 
     df.to_parquet(out_pq, index=False)
     print(f"✅ visits parquet written → {out_pq}")
@@ -84,5 +223,14 @@ if __name__ == "__main__":
     p = argparse.ArgumentParser()
     p.add_argument("--input", required=True)
     p.add_argument("--out",   required=True)
+    p.add_argument("--backend", choices=BACKENDS, default="pandas")
+    p.add_argument("--shards",  type=int, default=0,
+                   help="hash-partition by service_point into N parquet parts")
+    p.add_argument("--workers", type=int, default=None)
     args = p.parse_args()
-    run_etl(args.input, args.out)
+    if args.shards and args.backend != "pandas":
+        p.error("--shards is only implemented for --backend pandas")
+    if args.shards:
+        run_etl_sharded(args.input, args.out, args.shards, args.workers)
+    else:
+        run_etl(args.input, args.out, args.backend)
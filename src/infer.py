@@ -4,35 +4,65 @@ Balanced Isolation-Forest  (captures over- *and* under-utilisation)
 Outputs:
     • output/visit_scores.csv
     • output/sp_metrics.csv  (includes lat, lon, Insight-ready)
+    • output/visit_iforest.pkl  (fitted forest + feature list, or the
+                                 segment registry with --segment_by /
+                                 --registry)
+    • output/score_index.npz    (sorted visit / SP scores for the dashboard's
+                                 contamination slider)
 """
-import argparse, numpy as np, pandas as pd
+import argparse, joblib, numpy as np, pandas as pd
 from pathlib import Path
 from sklearn.ensemble import IsolationForest
+import segments
+from utils import DERIVED_COLS, cached_features, derived_features, visit_matrix
 
 # -------------------------------------------------------------------------
-def fit_score_visits(pq_path: str, contamination: float, n_estimators: int):
+def fit_score_visits(pq_path: str, contamination: float, n_estimators: int,
+                     n_jobs: int = -1, return_model: bool = False,
+                     segment_by: str = None, n_segments: int = 4,
+                     cache: bool = True, registry: str = None):
     df = pd.read_parquet(pq_path)
 
-    # symmetric features
-    df["inv_fill"]   = 1 - df["V_fill"]
-    df["abs_z_fill"] = np.abs((df["V_fill"] - df["V_fill"].mean()) /
-                              df["V_fill"].std())
+    # base features + symmetric inv_fill / abs_z_fill, as one float32 matrix
+    if cache:   # .npy memmap shared with train.py, keyed by parquet hash
+        X, feat_cols, _ = cached_features(pq_path, df)
+    else:
+        X, feat_cols, _ = visit_matrix(df)
+    df[DERIVED_COLS] = derived_features(df)          # float64 for the csv
 
-    feat_cols = [c for c in df.columns if c not in ("service_point","visit_date")]
-    X = df[feat_cols].fillna(df[feat_cols].median()).values
-
-    iforest = IsolationForest(
+    params = dict(
         n_estimators=n_estimators,
         contamination=contamination,
         max_samples="auto",
         bootstrap=True,
         random_state=42,
-        n_jobs=-1,
-    ).fit(X)
-
-    df["anomaly_score"] = -iforest.score_samples(X)
+        n_jobs=n_jobs,
+    )
+    if registry:
+        # segment models fitted by train.py: route and score, no refit
+        reg = segments.load_registry(registry)
+        if reg["features"] != feat_cols:
+            raise ValueError(f"registry {registry} was fitted on "
+                             f"{reg['features']}, visits have {feat_cols}")
+        seg = segments.assign_segments(df, reg["by"], reg["spec"])
+        df["anomaly_score"] = segments.score_samples(reg["models"], X, seg)
+        df["segment"] = seg
+        iforest = {k: reg[k] for k in ("by", "spec", "models")}
+    elif segment_by:
+        # one forest per segment, each visit scored by its own segment
+        spec = segments.fit_segments(df, segment_by, n_segments)
+        seg = segments.assign_segments(df, segment_by, spec)
+        models = segments.fit_models(X, seg, params)
+        df["anomaly_score"] = segments.score_samples(models, X, seg)
+        df["segment"] = seg
+        iforest = {"by": segment_by, "spec": spec, "models": models}
+    else:
+        iforest = IsolationForest(**params).fit(X)
+        df["anomaly_score"] = -iforest.score_samples(X)
     thresh = np.quantile(df["anomaly_score"], 1 - contamination)
     df["is_anomaly"] = (df["anomaly_score"] >= thresh).astype(int)
+    if return_model:
+        return df, iforest, feat_cols
     return df
 
 # -------------------------------------------------------------------------
@@ -58,15 +88,90 @@ def build_sp(df_vis: pd.DataFrame, contamination: float) -> pd.DataFrame:
     sp["Anomaly State"] = np.where(sp["Max Anomaly Score"] >= q, "Yes", "No")
     return sp
 
+def build_sp_polars(df_vis: pd.DataFrame, contamination: float) -> pd.DataFrame:
+    """build_sp as one lazy Polars aggregation (only the used columns are read)."""
+    try:
+        import polars as pl
+    except ImportError as e:
+        raise ImportError("backend 'polars' needs `pip install polars`") from e
+
+    cols = ["service_point", "anomaly_score", "lat", "lon", "V_kg",
+            "capacity_kg", "V_fill", "GR", "VI"]
+    c = pl.col
+    first = lambda name: c(name).drop_nulls().first()     # pandas .first()
+    sp = (
+        pl.from_pandas(df_vis[cols]).lazy()
+          .group_by("service_point")
+          .agg(
+              pl.len().alias("Visit Count"),
+              c("anomaly_score").max().alias("Max Anomaly Score"),
+              first("lat").alias("lat"),
+              first("lon").alias("lon"),
+              (c("V_kg").quantile(0.90, "linear") / first("capacity_kg"))
+                .alias("CAIv Ratio"),
+              ((c("V_fill") > 1).fill_null(False).mean() * 100).alias("VOF %"),
+              (c("V_fill").mean() * 100).alias("VUR %"),
+              (c("V_kg").std() / c("V_kg").mean()).alias("CVv Ratio"),
+              (c("V_kg").max() / c("V_kg").mean()).alias("PMRv Ratio"),
+              c("GR").quantile(0.90, "linear").alias("GR p90 (kg/day)"),
+              (first("capacity_kg") / c("GR").median()).alias("DtO (days)"),
+              c("VI").max().alias("IG (days)"),
+              (c("GR").std() / c("GR").mean()).alias("CVgr Ratio"),
+          )
+          .sort("service_point")
+          .rename({"service_point": "Service Point"})
+          .collect()
+          .to_pandas()
+    )
+    q = np.quantile(sp["Max Anomaly Score"], 1 - contamination)
+    sp["Anomaly State"] = np.where(sp["Max Anomaly Score"] >= q, "Yes", "No")
+    return sp
+
+BUILD_SP = {"pandas": build_sp, "polars": build_sp_polars}
+
+# -------------------------------------------------------------------------
+def save_score_index(path, df_vis: pd.DataFrame, sp: pd.DataFrame,
+                     contamination: float):
+    """
+    Sorted visit- and SP-level scores.  Any other contamination rate can then
+    be applied by binary search instead of rerunning the pipeline;
+    `sp_order` maps the sorted SP scores back to the rows of sp_metrics,
+    whose Service Point column is stored as `sp_names` so readers can tell
+    when sp_metrics.csv was rewritten without the index.
+    """
+    sp_scores = sp["Max Anomaly Score"].to_numpy()
+    sp_order = np.argsort(sp_scores, kind="stable")
+    np.savez(
+        path,
+        visit=np.sort(df_vis["anomaly_score"].to_numpy()),
+        sp=sp_scores[sp_order],
+        sp_order=sp_order,
+        sp_names=sp["Service Point"].to_numpy(dtype=str),
+        contamination=contamination,
+    )
+
 # -------------------------------------------------------------------------
-def main(in_pq: str, contamination=0.05, n_estimators=400):
-    df_vis = fit_score_visits(in_pq, contamination, n_estimators)
-    Path("output").mkdir(exist_ok=True)
-    df_vis.to_csv("output/visit_scores.csv", index=False)
+def main(in_pq: str, contamination=0.05, n_estimators=400,
+         out_dir="output", n_jobs=-1, segment_by=None, n_segments=4,
+         backend="pandas", registry=None):
+    df_vis, iforest, feat_cols = fit_score_visits(
+        in_pq, contamination, n_estimators, n_jobs, return_model=True,
+        segment_by=segment_by, n_segments=n_segments, registry=registry)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    df_vis.to_csv(out_dir / "visit_scores.csv", index=False)
+    if segment_by or registry:
+        joblib.dump({**iforest, "features": feat_cols},
+                    out_dir / "visit_iforest.pkl")
+    else:
+        joblib.dump({"model": iforest, "features": feat_cols},
+                    out_dir / "visit_iforest.pkl")
 
-    sp = build_sp(df_vis, contamination)
-    sp.to_csv("output/sp_metrics.csv", index=False)
-    print("✅ visit_scores.csv & sp_metrics.csv created in /output")
+    sp = BUILD_SP[backend](df_vis, contamination)
+    sp.to_csv(out_dir / "sp_metrics.csv", index=False)
+    save_score_index(out_dir / "score_index.npz", df_vis, sp, contamination)
+    print(f"✅ visit_scores.csv & sp_metrics.csv created in {out_dir}")
+    return df_vis, sp
 
 # -------------------------------------------------------------------------
 if __name__ == "__main__":
@@ -74,5 +179,13 @@ if __name__ == "__main__":
     p.add_argument("--in_pq", default="data/processed/visits.parquet")
     p.add_argument("--contam", type=float, default=0.05)
     p.add_argument("--n_estimators", type=int, default=400)
+    p.add_argument("--out_dir", default="output")
+    p.add_argument("--segment_by", choices=segments.SEGMENT_BY, default=None)
+    p.add_argument("--n_segments", type=int, default=4)
+    p.add_argument("--backend", choices=tuple(BUILD_SP), default="pandas")
+    p.add_argument("--registry", default=None,
+                   help="score with the segment registry from train.py")
     args = p.parse_args()
-    main(args.in_pq, args.contam, args.n_estimators)
+    main(args.in_pq, args.contam, args.n_estimators, args.out_dir,
+         segment_by=args.segment_by, n_segments=args.n_segments,
+         backend=args.backend, registry=args.registry)
@@ -0,0 +1,113 @@
+# ----------------------------- segments.py -----------------------------
+"""
+Fleet segmentation for per-segment Isolation Forests
+    • capacity – quantile bands of capacity_kg (per service point)
+    • geo      – k-means clusters of service-point lat / lon
+
+A segment spec (edges or cluster centres) is enough to route any visit to
+its segment, so it is persisted next to the per-segment models in a
+registry:  {"by", "spec", "features", "models": {segment: model | path}}
+The models take the unscaled utils.cached_features matrix, so train.py can
+write a registry that `infer.py --registry` scores with directly.
+"""
+import joblib, warnings, numpy as np, pandas as pd
+from pathlib import Path
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans
+from sklearn.ensemble import IsolationForest
+
+SEGMENT_BY = ("capacity", "geo")
+MIN_SEGMENT_VISITS = 256        # IsolationForest's default sub-sample size
+
+
+# -------------------------------------------------------------------------
+def fit_segments(df: pd.DataFrame, by: str, n_segments: int) -> dict:
+    """
+    Derive the segment spec from the service points in df.  Warns when
+    fewer segments than asked for come out (e.g. capacity quantiles that
+    coincide) and rejects segments with fewer than MIN_SEGMENT_VISITS visits.
+    """
+    sp = df.groupby("service_point")[["capacity_kg", "lat", "lon"]].first()
+    if by == "capacity":
+        edges = np.unique(np.quantile(sp["capacity_kg"],
+                                      np.linspace(0, 1, n_segments + 1)))
+        spec = {"edges": edges[1:-1].tolist()}
+    elif by == "geo":
+        ll = sp[["lat", "lon"]].fillna(sp[["lat", "lon"]].median()).values
+        km = KMeans(n_clusters=min(n_segments, len(sp)), n_init=10,
+                    random_state=42).fit(ll)
+        spec = {"centers": km.cluster_centers_.tolist(),
+                "fill": sp[["lat", "lon"]].median().tolist()}
+    else:
+        raise ValueError(f"unknown segment_by '{by}', expected one of {SEGMENT_BY}")
+
+    n_visits = np.bincount(assign_segments(df, by, spec))
+    if len(n_visits) < n_segments:
+        warnings.warn(f"segment_by '{by}': {len(n_visits)} segments instead "
+                      f"of {n_segments} (coinciding quantiles or too few points)")
+    small = np.flatnonzero(n_visits < MIN_SEGMENT_VISITS)
+    if len(small):
+        raise ValueError(f"segments {small.tolist()} have "
+                         f"{n_visits[small].tolist()} visits, fewer than "
+                         f"{MIN_SEGMENT_VISITS}; use fewer segments")
+    return spec
+
+
+def assign_segments(df: pd.DataFrame, by: str, spec: dict) -> np.ndarray:
+    """Segment id per row of df."""
+    if by == "capacity":
+        return np.searchsorted(spec["edges"], df["capacity_kg"].values,
+                               side="right")
+    ll = df[["lat", "lon"]].fillna(dict(zip(["lat", "lon"], spec["fill"]))).values
+    d = ((ll[:, None, :] - np.asarray(spec["centers"])[None]) ** 2).sum(-1)
+    return d.argmin(axis=1)
+
+
+# -------------------------------------------------------------------------
+def _fit_one(X, rows, params):
+    return IsolationForest(**params).fit(X[rows])
+
+
+def fit_models(X: np.ndarray, seg: np.ndarray, params: dict) -> dict:
+    """
+    One IsolationForest per segment, fitted in parallel (1 core each) over
+    params["n_jobs"] workers, so a caller that splits the cores is honoured.
+    X is passed whole so a memmap reaches the workers by reference; each
+    worker slices its own rows.
+    """
+    n_jobs = params.get("n_jobs", -1)
+    params = {**params, "n_jobs": 1}
+    keys = np.unique(seg).tolist()
+    models = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_one)(X, np.flatnonzero(seg == k), params) for k in keys)
+    return dict(zip(keys, models))
+
+
+def score_samples(models: dict, X: np.ndarray, seg: np.ndarray) -> np.ndarray:
+    """Anomaly score (higher = more anomalous), each row by its own segment."""
+    out = np.full(len(X), np.nan)
+    for k, mdl in models.items():
+        m = seg == k
+        if m.any():
+            out[m] = -mdl.score_samples(X[m])
+    return out
+
+
+# -------------------------------------------------------------------------
+def save_registry(path, by: str, spec: dict, features, models: dict) -> dict:
+    """Persist each model as seg_<k>.pkl and the registry pointing at them."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for k, mdl in models.items():
+        paths[k] = str(path.parent / f"seg_{k}.pkl")
+        joblib.dump(mdl, paths[k])
+    reg = {"by": by, "spec": spec, "features": list(features), "models": paths}
+    joblib.dump(reg, path)
+    return reg
+
+
+def load_registry(path) -> dict:
+    reg = joblib.load(path)
+    reg["models"] = {k: joblib.load(p) for k, p in reg["models"].items()}
+    return reg
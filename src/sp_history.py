@@ -0,0 +1,133 @@
+# ----------------------------- sp_history.py -----------------------------
+"""
+Historical sp_metrics time series in one sorted pass
+Input : output/visit_scores.csv
+Output: output/sp_history.parquet – one row per (service point, period)
+        columns: service_point · period · Visit Count · CAIv Ratio · VOF % ·
+                 VUR % · Max Anomaly Score · Anomaly State
+
+Visits are sorted once by (service_point, visit_date); every metric is then
+an expanding (or time-windowed, e.g. --window 90D) aggregation along that
+order, so all snapshots come out of a single pass instead of rerunning
+build_sp per day.  Expanding: the last visit of each period is the snapshot
+and is carried forward over periods without visits.  Windowed: the window is
+evaluated at every period end, so visits age out of it; a service point with
+no visit in the window has Visit Count 0 and NaN metrics.
+"""
+import argparse, numpy as np, pandas as pd
+from pathlib import Path
+
+
+# -------------------------------------------------------------------------
+def _agg(df: pd.DataFrame, col: str, how: str, window=None, **kw) -> np.ndarray:
+    """Expanding / rolling aggregation per SP, aligned with sorted df rows."""
+    s = df.set_index("visit_date").groupby("service_point", sort=False)[col]
+    r = s.expanding() if window is None else s.rolling(window)
+    return getattr(r, how)(**kw).to_numpy()
+
+
+def _metrics(df: pd.DataFrame, window=None) -> dict:
+    """Metric columns for every row of the sorted df (NaN rows are skipped)."""
+    return {
+        "Visit Count":       _agg(df, "V_kg", "count", window),
+        "CAIv Ratio":        _agg(df, "V_kg", "quantile", window, q=0.90)
+                             / df["capacity_kg"].to_numpy(),
+        "VOF %":             _agg(df, "overflow", "mean", window) * 100,
+        "VUR %":             _agg(df, "V_fill", "mean", window) * 100,
+        "Max Anomaly Score": _agg(df, "anomaly_score", "max", window),
+    }
+
+
+def _period_ends(df: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """One empty row per SP at the end of every period from its first visit."""
+    first = df.groupby("service_point", sort=False)["visit_date"].min()
+    periods = pd.period_range(first.min().to_period(freq),
+                              df["visit_date"].max().to_period(freq), freq=freq)
+    sp = np.repeat(first.index.to_numpy(), len(periods))
+    per = np.tile(periods.to_timestamp(how="start"), len(first))
+    keep = per >= np.repeat(first.dt.to_period(freq).dt.start_time.to_numpy(),
+                            len(periods))
+    cap = df.groupby("service_point", sort=False)["capacity_kg"].first()
+    per = pd.DatetimeIndex(per[keep])
+    return pd.DataFrame({
+        "service_point": sp[keep],
+        "visit_date":    (per.to_period(freq).end_time).to_numpy(),
+        "capacity_kg":   cap.reindex(sp[keep]).to_numpy(),
+        "period":        per.to_numpy(),
+    })
+
+
+def history(df_vis: pd.DataFrame, contamination: float, freq="W",
+            window=None) -> pd.DataFrame:
+    df = df_vis[["service_point", "visit_date", "V_kg", "V_fill",
+                 "capacity_kg", "anomaly_score"]].copy()
+    df["visit_date"] = pd.to_datetime(df["visit_date"])
+    df["overflow"] = (df["V_fill"] > 1).astype(float)
+
+    if window is None:
+        df = df.sort_values(["service_point", "visit_date"], kind="stable")
+        snap = pd.DataFrame({
+            "service_point": df["service_point"].to_numpy(),
+            "period":        df["visit_date"].dt.to_period(freq).dt.start_time.to_numpy(),
+            **_metrics(df),
+        })
+        snap = snap.groupby(["service_point", "period"], sort=False).last()
+
+        # ---- carry each SP's last snapshot over the periods without visits
+        per = snap.index.get_level_values("period")
+        periods = pd.period_range(per.min(), per.max(), freq=freq).start_time
+        full = pd.MultiIndex.from_product(
+            [snap.index.get_level_values("service_point").unique(), periods],
+            names=["service_point", "period"])
+        ts = snap.reindex(full).groupby(level="service_point").ffill()
+        ts = ts.dropna(subset=["Visit Count"]).reset_index()   # before first visit
+    else:
+        # ---- a window moves on without visits: evaluate it at every period
+        #      end by sorting one empty row per (SP, period end) into the pass
+        ends = _period_ends(df, freq)
+        df = pd.concat([df, ends], ignore_index=True)
+        df = df.sort_values(["service_point", "visit_date"], kind="stable")
+        m = _metrics(df, window)
+        at_end = df["period"].notna().to_numpy()
+        ts = pd.DataFrame({
+            "service_point": df["service_point"].to_numpy()[at_end],
+            "period":        df["period"].to_numpy()[at_end],
+            **{k: v[at_end] for k, v in m.items()},
+        })
+
+    # ---- anomaly state: cross-sectional threshold per period
+    q = ts.groupby("period")["Max Anomaly Score"].transform(
+        lambda s: np.nanquantile(s, 1 - contamination))
+    ts["Anomaly State"] = np.where(ts["Max Anomaly Score"] >= q, "Yes", "No")
+
+    # compact columnar layout
+    ts["service_point"] = ts["service_point"].astype("category")
+    ts["Anomaly State"] = ts["Anomaly State"].astype("category")
+    ts["Visit Count"] = ts["Visit Count"].astype("int32")
+    for c in ["CAIv Ratio", "VOF %", "VUR %", "Max Anomaly Score"]:
+        ts[c] = ts[c].astype("float32")
+    return ts
+
+
+# -------------------------------------------------------------------------
+def main(visits="output/visit_scores.csv", out="output/sp_history.parquet",
+         contamination=0.05, freq="W", window=None):
+    df_vis = pd.read_csv(visits)
+    ts = history(df_vis, contamination, freq, window)
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    ts.to_parquet(out, index=False)
+    print(f"✅ {len(ts)} snapshots ({ts['period'].nunique()} periods) → {out}")
+    return ts
+
+
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--visits", default="output/visit_scores.csv")
+    p.add_argument("--out",    default="output/sp_history.parquet")
+    p.add_argument("--contam", type=float, default=0.05)
+    p.add_argument("--freq",   default="W", help="D (daily) or W (weekly)")
+    p.add_argument("--window", default=None,
+                   help="time window such as 90D; default is expanding")
+    args = p.parse_args()
+    main(args.visits, args.out, args.contam, args.freq, args.window)
@@ -0,0 +1,297 @@
+# ----------------------------- sp_sketch.py -----------------------------
+"""
+Incremental sp_metrics via mergeable per-service-point summaries
+Input : the new visits since the last refresh (csv / parquet, visit_scores
+        layout) + output/score_index.npz of the current infer run
+Output: sketch state (.pkl) + sp_metrics refreshed from the state
+
+Per service point the state keeps
+    • n, first lat / lon / capacity_kg, last visit_date (the watermark)
+    • count / sum / sum-of-squares of V_kg, V_fill and GR
+    • max of V_kg and VI
+    • overflow counter  (V_fill > 1)
+    • a DDSketch-style log-bucket histogram of V_kg and GR for p90 / median,
+      stored sparse (only non-empty buckets) as one CSR matrix per column
+A refresh reads only the new visits and costs O(delta visits + service
+points); nothing per visit is kept, so the state grows with the number of
+service points and occupied buckets, not with the history.
+
+Visits dated after their SP's watermark are folded in.  Visits on or
+before it are skipped and counted, because the state cannot tell them
+apart from visits it already has; late visits that are known to be new
+are folded with --late.  A visit that changes after it was folded in (e.g.
+a late task record re-aggregated into an existing day) is not revised.
+
+Anomaly scores are not accumulated: infer refits the forest on every run,
+so scores from different runs are not comparable.  Max Anomaly Score is
+read from the SP scores in the current run's score_index.npz.
+
+Error bounds
+------------
+Moments, maxima and counters are exact.  Quantiles come from log-spaced
+buckets with gamma = (1 + alpha) / (1 - alpha): every value x > MIN_VALUE
+is stored in bucket ceil(log_gamma x) and reported back as the bucket
+midpoint 2·gamma^k / (gamma + 1), so every order statistic is recovered
+within a relative error of `alpha` (default 1 %).  The quantile is then
+interpolated between ranks floor(q·(n-1)) and the next one exactly like
+pandas does in build_sp, so CAIv, GR p90 and DtO stay within `alpha`
+relative error of the exact values.  Values ≤ MIN_VALUE (incl. 0) are counted
+in a dedicated zero bucket and reported as 0; values above MAX_VALUE are
+clamped into the top bucket.
+"""
+import argparse, joblib, numpy as np, pandas as pd
+from pathlib import Path
+from scipy import sparse
+
+MIN_VALUE = 1e-3
+MAX_VALUE = 1e6
+DEFAULT_ALPHA = 0.01
+
+SUM_COLS = ["V_kg", "V_fill", "GR"]            # count / sum / sum-of-squares
+MAX_COLS = ["V_kg", "VI"]                      # running maxima
+SKETCH_COLS = ["V_kg", "GR"]                   # quantile sketches
+
+
+# -------------------------------------------------------------------------
+def _gamma(alpha: float) -> float:
+    return (1 + alpha) / (1 - alpha)
+
+
+def _n_buckets(alpha: float) -> int:
+    g = np.log(_gamma(alpha))
+    return int(np.ceil(np.log(MAX_VALUE) / g) - np.ceil(np.log(MIN_VALUE) / g)) + 2
+
+
+def _bucket(x: np.ndarray, alpha: float) -> np.ndarray:
+    """Bucket id per value; 0 is the zero bucket, NaN → -1."""
+    g = np.log(_gamma(alpha))
+    k0 = np.ceil(np.log(MIN_VALUE) / g)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = np.ceil(np.log(np.clip(x, MIN_VALUE, MAX_VALUE)) / g) - k0 + 1
+    k = np.where(x <= MIN_VALUE, 0, k)
+    return np.where(np.isnan(x), -1, k).astype(np.int64)
+
+
+def _bucket_value(idx: np.ndarray, alpha: float) -> np.ndarray:
+    gamma = _gamma(alpha)
+    k0 = np.ceil(np.log(MIN_VALUE) / np.log(gamma))
+    val = 2 * gamma ** (idx + k0 - 1) / (gamma + 1)
+    return np.where(idx == 0, 0.0, val)
+
+
+def sketch_quantile(counts: sparse.csr_matrix, q: float,
+                    alpha: float) -> np.ndarray:
+    """
+    Row-wise quantile of a sparse (n_sp, n_buckets) count matrix, linearly
+    interpolated between neighbouring ranks like pandas' Series.quantile.
+    """
+    counts = sparse.csr_matrix(counts)
+    counts.sum_duplicates()                  # also sorts the bucket indices
+    n = np.asarray(counts.sum(axis=1)).ravel()
+    if counts.nnz == 0:
+        return np.full(len(n), np.nan)
+    cum = np.cumsum(counts.data)             # running count over all rows
+    base = np.concatenate([[0], cum])[counts.indptr[:-1]]
+    h = q * np.clip(n - 1, 0, None)
+    lo = np.floor(h)
+    hi = np.minimum(lo + 1, np.clip(n - 1, 0, None))
+
+    def at(rank):                            # bucket value of the rank-th item
+        pos = np.searchsorted(cum, base + rank, side="right")
+        return _bucket_value(counts.indices[np.minimum(pos, len(cum) - 1)], alpha)
+
+    v_lo, v_hi = at(lo), at(hi)
+    return np.where(n > 0, v_lo + (h - lo) * (v_hi - v_lo), np.nan)
+
+
+# -------------------------------------------------------------------------
+def empty_state(alpha: float = DEFAULT_ALPHA) -> dict:
+    return {
+        "alpha":    alpha,
+        "scalars":  pd.DataFrame(index=pd.Index([], name="service_point")),
+        "sketches": {c: sparse.csr_matrix((0, _n_buckets(alpha)), dtype=np.int64)
+                     for c in SKETCH_COLS},
+    }
+
+
+def _summarise(df: pd.DataFrame, alpha: float):
+    """Per-SP summaries of a batch of visits, same layout as the state."""
+    g = df.groupby("service_point", sort=True)
+    s = pd.DataFrame({
+        "n":           g.size(),
+        "lat":         g["lat"].first(),
+        "lon":         g["lon"].first(),
+        "capacity_kg": g["capacity_kg"].first(),
+        "last_visit":  g["visit_date"].max(),
+        "overflow_n":  (df["V_fill"] > 1).groupby(df["service_point"]).sum(),
+    })
+    for c in SUM_COLS:
+        s[f"{c}_cnt"] = g[c].count()
+        s[f"{c}_sum"] = g[c].sum()
+        s[f"{c}_sq"]  = (df[c] ** 2).groupby(df["service_point"]).sum()
+    for c in MAX_COLS:
+        s[f"{c}_max"] = g[c].max()
+
+    codes = s.index.get_indexer(df["service_point"])
+    shape = (len(s), _n_buckets(alpha))
+    sk = {}
+    for c in SKETCH_COLS:
+        b = _bucket(df[c].to_numpy(dtype=float), alpha)
+        ok = b >= 0
+        sk[c] = sparse.csr_matrix(
+            (np.ones(ok.sum(), dtype=np.int64), (codes[ok], b[ok])), shape=shape)
+    return s, sk
+
+
+def _reindex_rows(m: sparse.csr_matrix, pos: np.ndarray, n_rows: int):
+    """Place the rows of m at positions pos of an n_rows-row matrix."""
+    m = m.tocoo()
+    return sparse.csr_matrix((m.data, (pos[m.row], m.col)),
+                             shape=(n_rows, m.shape[1]))
+
+
+def merge_state(state: dict, s: pd.DataFrame, sk: dict) -> dict:
+    """Merge per-SP summaries of new visits into the persisted state."""
+    old = state["scalars"]
+    idx = old.index.union(s.index)
+    a = old.reindex(idx)
+    b = s.reindex(idx)
+
+    out = pd.DataFrame(index=idx)
+    out.index.name = "service_point"
+    for c in ["lat", "lon", "capacity_kg"]:              # first seen wins
+        out[c] = a[c].combine_first(b[c]) if c in a else b[c]
+    add_cols = ["n", "overflow_n"] + [f"{c}_{k}" for c in SUM_COLS
+                                      for k in ("cnt", "sum", "sq")]
+    for c in add_cols:
+        out[c] = (a[c].fillna(0) if c in a else 0) + b[c].fillna(0)
+    for c in [f"{c}_max" for c in MAX_COLS] + ["last_visit"]:
+        out[c] = pd.concat([a[c], b[c]], axis=1).max(axis=1) if c in a else b[c]
+
+    pos_old = idx.get_indexer(old.index)
+    pos_new = idx.get_indexer(s.index)
+    sketches = {c: _reindex_rows(state["sketches"][c], pos_old, len(idx))
+                   + _reindex_rows(sk[c], pos_new, len(idx))
+                for c in SKETCH_COLS}
+    return {**state, "scalars": out, "sketches": sketches}
+
+
+def split_late(state: dict, df_vis: pd.DataFrame):
+    """(visits after their SP's last_visit, visits on or before it)."""
+    df_vis = df_vis.copy()
+    df_vis["visit_date"] = pd.to_datetime(df_vis["visit_date"])
+    late = np.zeros(len(df_vis), dtype=bool)
+    if len(state["scalars"]):
+        wm = df_vis["service_point"].map(state["scalars"]["last_visit"])
+        late = (df_vis["visit_date"] <= wm).to_numpy()
+    return df_vis[~late], df_vis[late]
+
+
+def update(state: dict, df_vis: pd.DataFrame) -> dict:
+    """Fold a batch of visits into state; the caller guarantees they are new."""
+    if df_vis.empty:
+        return state
+    df_vis = df_vis.assign(visit_date=pd.to_datetime(df_vis["visit_date"]))
+    s, sk = _summarise(df_vis, state["alpha"])
+    return merge_state(state, s, sk)
+
+
+# -------------------------------------------------------------------------
+def _std(cnt, tot, sq):
+    var = (sq - tot ** 2 / cnt) / (cnt - 1)
+    return np.sqrt(np.clip(var, 0, None))
+
+
+def sp_metrics(state: dict, contamination: float,
+               max_score: pd.Series) -> pd.DataFrame:
+    """
+    sp_metrics table (same columns as infer.build_sp) from the state.
+    max_score: Max Anomaly Score per service point from the current run; SPs
+    it does not cover get NaN and are never flagged.
+    """
+    s, a = state["scalars"], state["alpha"]
+    vkg_p90 = sketch_quantile(state["sketches"]["V_kg"], 0.90, a)
+    gr_p90  = sketch_quantile(state["sketches"]["GR"], 0.90, a)
+    gr_med  = sketch_quantile(state["sketches"]["GR"], 0.50, a)
+    vkg_mean = s["V_kg_sum"] / s["V_kg_cnt"]
+    gr_mean  = s["GR_sum"] / s["GR_cnt"]
+
+    sp = pd.DataFrame({
+        "Service Point":     s.index,
+        "Visit Count":       s["n"].astype(int).values,
+        "Max Anomaly Score": max_score.reindex(s.index).values,
+        "lat":               s["lat"].values,
+        "lon":               s["lon"].values,
+        "CAIv Ratio":        vkg_p90 / s["capacity_kg"].values,
+        "VOF %":             (s["overflow_n"] / s["V_fill_cnt"] * 100).values,
+        "VUR %":             (s["V_fill_sum"] / s["V_fill_cnt"] * 100).values,
+        "CVv Ratio":         (_std(s["V_kg_cnt"], s["V_kg_sum"], s["V_kg_sq"])
+                              / vkg_mean).values,
+        "PMRv Ratio":        (s["V_kg_max"] / vkg_mean).values,
+        "GR p90 (kg/day)":   gr_p90,
+        "DtO (days)":        s["capacity_kg"].values / gr_med,
+        "IG (days)":         s["VI_max"].values,
+        "CVgr Ratio":        (_std(s["GR_cnt"], s["GR_sum"], s["GR_sq"])
+                              / gr_mean).values,
+    })
+    q = np.nanquantile(sp["Max Anomaly Score"], 1 - contamination)
+    sp["Anomaly State"] = np.where(sp["Max Anomaly Score"] >= q, "Yes", "No")
+    return sp
+
+
+def load_state(path, alpha: float = DEFAULT_ALPHA) -> dict:
+    path = Path(path)
+    if not path.exists():
+        return empty_state(alpha)
+    state = joblib.load(path)
+    state.pop("seen", None)                  # older states: per-visit keys
+    state["sketches"] = {c: sparse.csr_matrix(m)      # older states: dense
+                         for c, m in state["sketches"].items()}
+    return state
+
+
+def load_max_score(score_index) -> pd.Series:
+    """Max Anomaly Score per service point from infer's score_index.npz."""
+    with np.load(score_index) as idx:
+        return pd.Series(idx["sp"], index=idx["sp_names"][idx["sp_order"]])
+
+
+# -------------------------------------------------------------------------
+def main(visits: str, state_path="output/sp_sketch.pkl",
+         out_csv="output/sp_metrics.csv", contamination=0.05,
+         alpha=DEFAULT_ALPHA, scores="output/score_index.npz", late=False):
+    df_vis = (pd.read_parquet(visits) if str(visits).endswith(".parquet")
+              else pd.read_csv(visits))
+    state = load_state(state_path, alpha)
+    new, old = split_late(state, df_vis)
+    if late:
+        new, old = pd.concat([new, old]), old.iloc[:0]
+    state = update(state, new)
+    Path(state_path).parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(state, state_path)
+
+    sp = sp_metrics(state, contamination, load_max_score(scores))
+    sp.to_csv(out_csv, index=False)
+    print(f"✅ {len(new)} new visits merged → {state_path}; sp_metrics → {out_csv}")
+    if len(old):
+        print(f"   {len(old)} visits on or before their service point's last "
+              f"visit skipped – rerun them with --late if they are new")
+    return sp
+
+
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--visits", required=True,
+                   help="visits added since the last refresh")
+    p.add_argument("--scores", default="output/score_index.npz")
+    p.add_argument("--state",  default="output/sp_sketch.pkl")
+    p.add_argument("--out",    default="output/sp_metrics.csv")
+    p.add_argument("--contam", type=float, default=0.05)
+    p.add_argument("--alpha",  type=float, default=DEFAULT_ALPHA)
+    p.add_argument("--late",   action="store_true",
+                   help="also fold visits dated on or before their service "
+                        "point's last visit (they must not have been folded)")
+    args = p.parse_args()
+    main(args.visits, args.state, args.out, args.contam, args.alpha,
+         args.scores, args.late)
@@ -1,22 +1,40 @@
 import argparse, yaml, joblib
 from pathlib import Path
 from sklearn.ensemble import IsolationForest
-from utils import load_features
+from utils import cached_features, load_features
+import segments
 
-def train(cfg_path: str):
+def train(cfg_path: str, segment_by: str = None):
     cfg = yaml.safe_load(open(cfg_path))
     df, X = load_features(
         cfg["paths"]["train_matrix"],  # fit_scaler=True ⟹ scalerı da kaydeder
         fit_scaler=True
     )
 
-    mdl = IsolationForest(
+    params = dict(
         n_estimators = cfg["iforest"]["n_estimators"],
         contamination= cfg["iforest"]["contamination"],
         bootstrap    = True,
         random_state = 42,
         n_jobs       = -1
     )
+
+    seg_cfg = cfg.get("segments", {})
+    segment_by = segment_by or seg_cfg.get("by")
+    if segment_by and segment_by != "none":
+        # ---- one smaller forest per segment, fitted in parallel on infer's
+        #      feature matrix so `infer.py --registry` can score with them
+        X, feat_cols, _ = cached_features(cfg["paths"]["train_matrix"], df)
+        spec = segments.fit_segments(df, segment_by, seg_cfg.get("n_segments", 4))
+        seg = segments.assign_segments(df, segment_by, spec)
+        models = segments.fit_models(X, seg, params)
+        registry_out = seg_cfg.get("registry_out", "models/segments/registry.pkl")
+        segments.save_registry(registry_out, segment_by, spec,
+                               feat_cols, models)
+        print(f"✅ {len(models)} segment models saved →", registry_out)
+        return
+
+    mdl = IsolationForest(**params)
     mdl.fit(X)
     Path(cfg["paths"]["model_out"]).parent.mkdir(parents=True, exist_ok=True)
     joblib.dump(mdl, cfg["paths"]["model_out"])
@@ -25,5 +43,7 @@ def train(cfg_path: str):
 if __name__ == "__main__":
     a = argparse.ArgumentParser()
     a.add_argument("--cfg", default="src/config.yml")
+    a.add_argument("--segment_by", choices=("none",) + segments.SEGMENT_BY,
+                   default=None, help="overrides segments.by in the config")
     args = a.parse_args()
-    train(args.cfg)
+    train(args.cfg, args.segment_by)
@@ -1,16 +1,164 @@
 # ----------------------------- utils.py -----------------------------
+from functools import lru_cache
 from pathlib import Path
+import hashlib, json, os
 import joblib
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import StandardScaler
 
 
-def load_features(pq_path: str, fit_scaler: bool = False):
+@lru_cache(maxsize=None)
+def _file_sha1(path: str, size: int, mtime_ns: int) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def parquet_hash(pq_path) -> str:
+    """
+    Content hash of the parquet file (memoised per size / mtime); for a
+    sharded dataset directory, the hash over all of its part files.
+    """
+    pq_path = Path(pq_path)
+    if pq_path.is_dir():
+        parts = [parquet_hash(p) for p in sorted(pq_path.glob("*.parquet"))]
+        return hashlib.sha1("|".join(parts).encode()).hexdigest()
+    st = os.stat(pq_path)
+    return _file_sha1(str(pq_path), st.st_size, st.st_mtime_ns)
+
+
+ID_COLS = ("service_point", "visit_date")
+DERIVED_COLS = ["inv_fill", "abs_z_fill"]       # infer'ın simetrik özellikleri
+_CACHE_VERSION = "float32-2"                    # matris düzeni değişince artır
+
+
+def derived_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Ham V_fill'den simetrik özellikler (float64, NaN korunur)."""
+    return pd.DataFrame({
+        "inv_fill":   1 - df["V_fill"],
+        "abs_z_fill": np.abs((df["V_fill"] - df["V_fill"].mean()) /
+                             df["V_fill"].std()),
+    }, index=df.index)
+
+
+def visit_matrix(df: pd.DataFrame, out: np.ndarray = None):
+    """
+    Baz özellikler + ``DERIVED_COLS``, her sütun kendi medyanıyla
+    doldurulmuş float32 matris.  ``out`` verilirse matris oraya yazılır
+    (ör. memmap).
+
+    Returns
+    -------
+    X : numpy.ndarray
+        (n_visits, n_features) float32.
+    feature_cols : list of str
+        Baz sütunlar önce, ``DERIVED_COLS`` sonda.
+    med : pandas.Series
+        Doldurmada kullanılan sütun medyanları.
+    """
+    base_cols = [c for c in df.columns if c not in ID_COLS]
+    feats = pd.concat([df[base_cols], derived_features(df)], axis=1)
+    med = feats.median(numeric_only=True)
+    if out is None:
+        out = np.empty(feats.shape, dtype=np.float32)
+    out[:] = feats.fillna(med).values
+    return out, list(feats.columns), med
+
+
+def _atomic_npy(npy: Path, shape, fill):
+    """
+    ``fill(X)`` ile doldurulan float32 .npy'yi (ve ``fill``'in döndürdüğü
+    sözlük varsa JSON yan dosyasını) pid'li
+    geçici dosyalara yazıp ``os.replace`` ile yerine taşır: önce yan dosya,
+    sonra .npy – paralel yazıcılar çakışmaz ve .npy görünür olduğunda yan
+    dosya da tamdır.
+    """
+    npy.parent.mkdir(parents=True, exist_ok=True)
+    tmp = npy.with_name(f"{npy.stem}.{os.getpid()}.tmp.npy")
+    X = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=shape)
+    meta = fill(X)
+    X.flush()
+    del X
+    if meta is not None:
+        json_path = npy.with_suffix(".json")
+        tmp_meta = json_path.with_name(f"{json_path.stem}.{os.getpid()}.tmp.json")
+        tmp_meta.write_text(json.dumps(meta))
+        os.replace(tmp_meta, json_path)
+    os.replace(tmp, npy)
+
+
+def cached_features(pq_path: str, df: pd.DataFrame = None,
+                    cache_dir: str = None):
+    """
+    Ziyaret özellik matrisini (``visit_matrix``) float32 .npy memmap olarak
+    önbellekler.
+
+    train baz sütunları (``X[:, :n_base]``), infer tüm matrisi kullanır;
+    ikisi de aynı dosyayı açar.  float32, IsolationForest'in kendi iç tipi
+    olduğundan infer'ın fit / score adımlarında kopya oluşmaz.
+
+    Anahtar = parquet içerik hash'i + sütun listesi; aynı anahtarla gelen her
+    tüketici (train, infer, paralel worker'lar) dosyayı yeniden oluşturmadan
+    salt-okunur memmap olarak açar.
+
+    Parameters
+    ----------
+    pq_path : str
+        Kaynak parquet (anahtarın parçası).
+    df : pandas.DataFrame, optional
+        Önbellek yoksa matrisin kurulacağı ham DataFrame. Verilmezse
+        parquet okunur.
+    cache_dir : str, optional
+        Varsayılan: parquet'in yanındaki ``cache/`` klasörü.
+
+    Returns
+    -------
+    X : numpy.memmap
+        (n_visits, n_features) float32, salt-okunur.
+    feature_cols : list of str
+        X'in sütunları; baz sütunlar önce, ``DERIVED_COLS`` sonda.
+    med : pandas.Series
+        Doldurmada kullanılan sütun medyanları.
+    """
+    pq_path = Path(pq_path)
+    if df is None:
+        df = pd.read_parquet(pq_path)
+    feature_cols = [c for c in df.columns if c not in ID_COLS] + DERIVED_COLS
+    key = hashlib.sha1(
+        "|".join([parquet_hash(pq_path), _CACHE_VERSION, *feature_cols]).encode()
+    ).hexdigest()[:16]
+    cache_dir = Path(cache_dir) if cache_dir else pq_path.parent / "cache"
+    npy = cache_dir / f"{pq_path.stem}.{key}.npy"
+    meta = npy.with_suffix(".json")
+
+    if not (npy.exists() and meta.exists()):
+        _atomic_npy(npy, (len(df), len(feature_cols)),
+                    lambda X: visit_matrix(df, out=X)[2].to_dict())
+
+    med = pd.Series(json.loads(meta.read_text()), dtype=float)
+    return np.load(npy, mmap_mode="r"), feature_cols, med
+
+
+def _scaled_cache(X: np.ndarray, scaler: StandardScaler, base_npy: Path):
+    """``scaler.transform(X)``'i kendi .npy memmap'inde önbellekler."""
+    key = hashlib.sha1(scaler.mean_.tobytes() + scaler.scale_.tobytes()
+                       ).hexdigest()[:8]
+    npy = base_npy.with_name(f"{base_npy.stem}.scaled.{key}.npy")
+    if not npy.exists():
+        def fill(out):
+            out[:] = scaler.transform(X)
+        _atomic_npy(npy, X.shape, fill)
+    return np.load(npy, mmap_mode="r")
+
+
+def load_features(pq_path: str, fit_scaler: bool = False, cache: bool = True):
     """
     Parquet dosyasını okur, 'service_point' & 'visit_date' dışındaki
-    sütunları özellik matrisi olarak döndürür; aynı anda NaN'leri
-    sütun medyanıyla doldurur ve StandardScaler uygular.
+    sütunları özellik matrisi olarak döndürür; NaN'ler sütun medyanıyla
+    doldurulmuş ve StandardScaler uygulanmıştır.
 
     Parameters
     ----------
@@ -18,24 +166,25 @@ def load_features(pq_path: str, fit_scaler: bool = False):
         Parquet dosya yolu (visit-level özellik matrisi).
     fit_scaler : bool, default False
         True ise scaler'ı bu X üzerinde fit eder ve .scaler.pkl dosyası oluşturur.
+    cache : bool, default True
+        Baz matrisi ``cached_features`` memmap'inden (infer ile aynı dosya),
+        ölçeklenmiş matrisi de yanındaki kendi memmap'inden okur.
 
     Returns
     -------
     df : pandas.DataFrame
-        Orijinal DataFrame (NaN'ler doldurulmuş).
+        Ham DataFrame (NaN'ler doldurulmamış; doldurulmuş değerler X'te).
     X_scaled : numpy.ndarray
-        Ölçeklenmiş özellik matrisi.
+        Ölçeklenmiş baz özellik matrisi (float32).
     """
     pq_path = Path(pq_path)
     df = pd.read_parquet(pq_path)
 
-    feature_cols = [c for c in df.columns if c not in ("service_point", "visit_date")]
-
-    # ---- NaN → sütun medyanı
-    med = df[feature_cols].median(numeric_only=True)
-    df[feature_cols] = df[feature_cols].fillna(med)
-
-    X = df[feature_cols].values
+    if cache:
+        X, feature_cols, _ = cached_features(pq_path, df)
+    else:
+        X, feature_cols, _ = visit_matrix(df)
+    X = X[:, :len(feature_cols) - len(DERIVED_COLS)]     # görünüm, kopya değil
 
     scaler_path = pq_path.with_suffix(".scaler.pkl")
     if fit_scaler or not scaler_path.exists():
@@ -44,5 +193,6 @@ def load_features(pq_path: str, fit_scaler: bool = False):
     else:
         scaler = joblib.load(scaler_path)
 
-    X_scaled = scaler.transform(X)
-    return df, X_scaled
+    if cache:
+        return df, _scaled_cache(X, scaler, Path(X.filename))
+    return df, scaler.transform(X)
@@ -0,0 +1,284 @@
+# ----------------------------- whatif.py -----------------------------
+"""
+What-if capacity simulator
+Input : output/visit_scores.csv + scenarios (CSV or --from_suggestions)
+Output: output/whatif_results.csv – one row per (scenario, service point)
+
+Scenario CSV
+    scenario,service_point,delta_kg
+    add_big,Aldi Nieuwerkerk,250
+    add_big,BS Willibrordus Esch,500
+Service points that a scenario does not mention keep their capacity.
+--from_suggestions builds one scenario ("ai_suggestions") from the same CAIv
+rules as the dashboard's get_ai_suggestions (+2 / +1 / -1 container, +1
+for the two highest-CAIv rebalance candidates); a point is never taken
+below one container, and its "containers" column lets the dashboard match
+each projection to its suggestion.  A scenario that leaves any service
+point without capacity is rejected.
+
+Replay
+    Every historical visit is replayed with the scenario's capacity_kg:
+    V_fill, VOF %, VUR %, CAIv and DtO are recomputed for all scenarios × all
+    service points at once.  Visits are sorted once by (service point, V_kg);
+    "visits above capacity" is then a single searchsorted over an
+    (n_scenarios, n_sp) capacity matrix, and the rest are closed forms of
+    per-SP p90 / mean / median.
+
+Monte Carlo (--draws N)
+    Each draw bootstraps every service point's visit history: each visit is
+    replaced by a random visit of the same SP, taking its V_kg and GR as a
+    pair, so GR's dependence on the visit interval is kept and, with no
+    capacity change, the baseline reproduces history within sampling noise
+    (checked after the run).  Draws are split over a process pool
+    (independent SeedSequence streams); workers return running sums, so the
+    result is the mean / std per scenario and SP plus the share of draws
+    with VOF above 5 %.
+"""
+import argparse, os, numpy as np, pandas as pd
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+METRICS = ["VOF %", "VUR %", "CAIv Ratio", "DtO (days)"]
+VOF_ALERT = 5.0                                    # % – "significant problem"
+
+
+# -------------------------------------------------------------------------
+def _segments(codes: np.ndarray, n_sp: int):
+    counts = np.bincount(codes, minlength=n_sp)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return starts, counts
+
+
+def _sort_by_sp(codes: np.ndarray, x: np.ndarray):
+    order = np.lexsort((x, codes))
+    return codes[order], x[order]
+
+
+def _seg_quantile(xs, starts, counts, q):
+    """Linear-interpolated quantile of each SP's sorted segment."""
+    last = starts + np.clip(counts - 1, 0, None)
+    h = q * np.clip(counts - 1, 0, None)
+    lo = np.floor(h).astype(int)
+    i = np.minimum(starts + lo, len(xs) - 1)
+    j = np.minimum(np.minimum(i + 1, last), len(xs) - 1)
+    val = xs[i] + (h - lo) * (xs[j] - xs[i])
+    return np.where(counts > 0, val, np.nan)
+
+
+def _count_above(codes_s, xs, starts, counts, cap):
+    """
+    Visits with value > cap, per scenario and SP.  cap: (n_scen, n_sp).
+    Segments are laid end to end with an offset per SP code, so one global
+    searchsorted answers every (scenario, SP) pair.
+    """
+    lo = xs.min() if len(xs) else 0.0
+    off = (xs.max() - lo + 1.0) if len(xs) else 1.0
+    keys = codes_s * off + (xs - lo)
+    sp = np.arange(cap.shape[1])
+    q = sp * off + np.clip(cap - lo, -0.5, off - 0.5)
+    pos = np.searchsorted(keys, q, side="right")
+    return (starts + counts)[None, :] - pos
+
+
+def _metrics(codes_s, v_s, gr_med, cap, n_sp):
+    """VOF %, VUR %, CAIv, DtO for every scenario × SP from sorted V_kg."""
+    starts, counts = _segments(codes_s, n_sp)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        over = _count_above(codes_s, v_s, starts, counts, cap)
+        v_mean = np.bincount(codes_s, weights=v_s, minlength=n_sp) / counts
+        v_p90 = _seg_quantile(v_s, starts, counts, 0.90)
+        return {
+            "VOF %":      over / counts * 100,
+            "VUR %":      v_mean / cap * 100,
+            "CAIv Ratio": v_p90 / cap,
+            "DtO (days)": cap / gr_med,
+        }
+
+
+# -------------------------------------------------------------------------
+def capacity_matrix(base_cap: pd.Series, scenarios: pd.DataFrame):
+    """(n_scenarios, n_sp) capacities; row 0 is the unchanged 'baseline'."""
+    names = ["baseline"] + [s for s in scenarios["scenario"].unique()
+                            if s != "baseline"]
+    delta = (scenarios.pivot_table(index="scenario", columns="service_point",
+                                   values="delta_kg", aggfunc="sum")
+                      .reindex(index=names, columns=base_cap.index)
+                      .fillna(0.0))
+    cap = base_cap.to_numpy()[None, :] + delta.to_numpy()
+    bad = np.argwhere(cap <= 0)
+    if len(bad):
+        s, i = bad[0]
+        raise ValueError(f"scenario '{names[s]}' leaves {len(bad)} service "
+                         f"point(s) without capacity, e.g. "
+                         f"{base_cap.index[i]} ({cap[s, i]:g} kg)")
+    return names, cap
+
+
+def suggestion_scenarios(sp: pd.DataFrame, container_kg=250.0,
+                         capacity: pd.Series = None) -> pd.DataFrame:
+    """
+    Capacity changes implied by the dashboard's CAIv suggestion rules.
+    capacity: current capacity_kg per service point; "-1 container" is
+    dropped where it would leave less than one container.
+    """
+    flagged = sp[sp["Anomaly State"] == "Yes"]
+    caiv = flagged["CAIv Ratio"]
+    n = np.select([caiv > 1.2, caiv > 0.9, caiv < 0.3], [2, 1, -1], 0)
+    # the two highest-CAIv rebalance candidates also get +1 container
+    rebalance = np.flatnonzero(n == 0)
+    n[rebalance[np.argsort(-caiv.values[rebalance], kind="stable")[:2]]] = 1
+    if capacity is not None:
+        cap = capacity.reindex(flagged["Service Point"]).to_numpy()
+        n[(n < 0) & ~(cap - container_kg >= container_kg)] = 0
+    return pd.DataFrame({"scenario": "ai_suggestions",
+                         "service_point": flagged["Service Point"].values,
+                         "delta_kg": n * container_kg,
+                         "containers": n})[n != 0]
+
+
+def replay(df_vis: pd.DataFrame, scenarios: pd.DataFrame):
+    """Deterministic replay of all visits under every scenario."""
+    sp_idx = pd.Index(sorted(df_vis["service_point"].unique()))
+    codes = sp_idx.get_indexer(df_vis["service_point"])
+    base_cap = df_vis.groupby("service_point")["capacity_kg"].first().reindex(sp_idx)
+    names, cap = capacity_matrix(base_cap, scenarios)
+
+    codes_s, v_s = _sort_by_sp(codes, df_vis["V_kg"].to_numpy(dtype=float))
+    gr_med = df_vis.groupby("service_point")["GR"].median().reindex(sp_idx).to_numpy()
+    res = _metrics(codes_s, v_s, gr_med, cap, len(sp_idx))
+    ctx = {"sp_idx": sp_idx, "names": names, "cap": cap, "codes": codes}
+    return res, ctx
+
+
+# -------------------------------------------------------------------------
+def _mc_worker(codes, v_kg, gr, cap, n_sp, n_draws, seed):
+    """Run n_draws bootstrapped replays; return running sums per metric."""
+    rng = np.random.default_rng(seed)
+    order = np.argsort(codes, kind="stable")
+    codes, v_kg, gr = codes[order], v_kg[order], gr[order]
+    starts, counts = _segments(codes, n_sp)
+    acc = {m: [np.zeros_like(cap) for _ in range(3)] for m in METRICS}
+    alert = np.zeros_like(cap)
+    for _ in range(n_draws):
+        # a random visit of the same SP for every visit: (V_kg, GR) pairs
+        pick = starts[codes] + (rng.random(len(codes)) * counts[codes]).astype(int)
+        c_s, v_s = _sort_by_sp(codes, v_kg[pick])
+        ok = np.isfinite(gr[pick])
+        g_codes, g_s = _sort_by_sp(codes[ok], gr[pick][ok])
+        g_starts, g_counts = _segments(g_codes, n_sp)
+        gr_med = _seg_quantile(g_s, g_starts, g_counts, 0.50)
+        res = _metrics(c_s, v_s, gr_med, cap, n_sp)
+        for m in METRICS:                    # sum, sum of squares, n finite
+            ok = np.isfinite(res[m])
+            x = np.where(ok, res[m], 0.0)
+            acc[m][0] += x
+            acc[m][1] += x ** 2
+            acc[m][2] += ok
+        alert += res["VOF %"] > VOF_ALERT
+    return acc, alert, n_draws
+
+
+def monte_carlo(df_vis: pd.DataFrame, ctx: dict, n_draws: int, workers=None,
+                seed=42):
+    codes = ctx["codes"]
+    v_kg = df_vis["V_kg"].to_numpy(dtype=float)
+    gr = df_vis["GR"].to_numpy(dtype=float)
+    n_sp = len(ctx["sp_idx"])
+
+    workers = max(1, min(workers or os.cpu_count() or 1, n_draws))
+    split = [len(a) for a in np.array_split(np.arange(n_draws), workers)]
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    mp_ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_ctx) as pool:
+        futs = [pool.submit(_mc_worker, codes, v_kg, gr, ctx["cap"], n_sp, k, s)
+                for k, s in zip(split, seeds) if k]
+        parts = [f.result() for f in futs]
+
+    out = {}
+    for m in METRICS:
+        tot, sq, n = (sum(p[0][m][k] for p in parts) for k in range(3))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = tot / n
+            out[f"{m} (MC mean)"] = mean
+            out[f"{m} (MC std)"] = np.sqrt(np.clip(sq / n - mean ** 2, 0, None))
+    out[f"P(VOF > {VOF_ALERT:g}%)"] = sum(p[1] for p in parts) / n_draws
+    return out
+
+
+def baseline_check(res: dict, n_draws: int, metric="VOF %") -> float:
+    """
+    z-score of the fleet-wide gap between the baseline scenario's MC mean and
+    its deterministic replay; |z| beyond ~4 means the resampling is biased.
+    """
+    det, mean = res[metric][0], res[f"{metric} (MC mean)"][0]
+    se2 = res[f"{metric} (MC std)"][0] ** 2 / n_draws
+    ok = np.isfinite(det) & np.isfinite(mean)
+    return float((mean[ok] - det[ok]).sum() / np.sqrt(max(se2[ok].sum(), 1e-300)))
+
+
+# -------------------------------------------------------------------------
+def to_frame(res: dict, ctx: dict) -> pd.DataFrame:
+    n_scen, n_sp = ctx["cap"].shape
+    out = pd.DataFrame({
+        "scenario":      np.repeat(ctx["names"], n_sp),
+        "Service Point": np.tile(ctx["sp_idx"].to_numpy(), n_scen),
+        "capacity_kg":   ctx["cap"].ravel(),
+    })
+    for k, v in res.items():
+        out[k] = np.asarray(v).ravel()
+    return out
+
+
+def main(visits="output/visit_scores.csv", scenarios=None,
+         from_suggestions=False, sp_metrics="output/sp_metrics.csv",
+         container_kg=250.0, draws=0, workers=None,
+         out="output/whatif_results.csv"):
+    df_vis = pd.read_csv(visits)
+    frames = []
+    if scenarios:
+        frames.append(pd.read_csv(scenarios))
+    if from_suggestions:
+        capacity = df_vis.groupby("service_point")["capacity_kg"].first()
+        frames.append(suggestion_scenarios(pd.read_csv(sp_metrics),
+                                           container_kg, capacity))
+    sc = (pd.concat(frames, ignore_index=True) if frames else
+          pd.DataFrame(columns=["scenario", "service_point", "delta_kg"]))
+
+    res, ctx = replay(df_vis, sc)
+    if draws:
+        res.update(monte_carlo(df_vis, ctx, draws, workers))
+        z = baseline_check(res, draws)
+        print(f"   baseline MC vs replay: VOF {np.nanmean(res['VOF % (MC mean)'][0]):.2f}%"
+              f" vs {np.nanmean(res['VOF %'][0]):.2f}%  (z = {z:+.1f}"
+              f"{', outside sampling noise' if abs(z) > 4 else ''})")
+
+    result = to_frame(res, ctx)
+    if "containers" in sc:          # container count behind each suggestion
+        n = (sc.dropna(subset=["containers"])
+               .groupby(["scenario", "service_point"])["containers"].sum())
+        result["containers"] = n.reindex(
+            pd.MultiIndex.from_arrays([result["scenario"],
+                                       result["Service Point"]])).to_numpy()
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    result.to_csv(out, index=False)
+    print(f"✅ {len(ctx['names'])} scenarios × {len(ctx['sp_idx'])} service points"
+          f"{f' × {draws} draws' if draws else ''} → {out}")
+    return result
+
+
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--visits",    default="output/visit_scores.csv")
+    p.add_argument("--scenarios", default=None,
+                   help="CSV with scenario, service_point, delta_kg")
+    p.add_argument("--from_suggestions", action="store_true")
+    p.add_argument("--sp_metrics", default="output/sp_metrics.csv")
+    p.add_argument("--container_kg", type=float, default=250.0)
+    p.add_argument("--draws",   type=int, default=0)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--out",     default="output/whatif_results.csv")
+    args = p.parse_args()
+    main(args.visits, args.scenarios, args.from_suggestions, args.sp_metrics,
+         args.container_kg, args.draws, args.workers, args.out)
@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from pathlib import Path
 
 # --------------------------------------------------------------------------
@@ -385,6 +386,71 @@ def load_data(relative_path):
         return pd.DataFrame()
     return pd.read_csv(data_file)
 
+@st.cache_data
+def load_score_index(relative_path):
+    """
+    Loads the sorted visit / service point scores written by infer.py.
+    Returns None when the index has not been generated.
+    """
+    data_file = Path(__file__).resolve().parent / relative_path
+    if not data_file.exists():
+        return None
+    with np.load(data_file) as idx:
+        return {k: idx[k] for k in idx.files}
+
+def quantile_sorted(scores, q):
+    """np.quantile (linear) on an already sorted array, in O(1)."""
+    h = (len(scores) - 1) * q
+    lo = int(np.floor(h))
+    hi = min(lo + 1, len(scores) - 1)
+    return scores[lo] + (h - lo) * (scores[hi] - scores[lo])
+
+def apply_contamination(df, score_index, contamination):
+    """
+    Re-labels 'Anomaly State' for a new contamination rate by binary search
+    on the sorted scores; returns the relabelled df and the anomalous visit count.
+    """
+    sp_sorted = score_index['sp']
+    sp_thresh = quantile_sorted(sp_sorted, 1 - contamination)
+    first = np.searchsorted(sp_sorted, sp_thresh, side='left')
+    is_anomaly = np.zeros(len(df), dtype=bool)
+    is_anomaly[score_index['sp_order'][first:]] = True
+
+    df = df.copy()
+    df['Anomaly State'] = np.where(is_anomaly, 'Yes', 'No')
+
+    visit_sorted = score_index['visit']
+    visit_thresh = quantile_sorted(visit_sorted, 1 - contamination)
+    anomalous_visits = len(visit_sorted) - np.searchsorted(visit_sorted, visit_thresh, side='left')
+    return df, int(anomalous_visits)
+
+@st.cache_data
+def load_whatif(relative_path):
+    """
+    Loads the what-if simulator results and returns, per service point whose
+    capacity the 'ai_suggestions' scenario changes, its baseline and
+    projected metrics side by side. Empty when the simulator has not run.
+    """
+    data_file = Path(__file__).resolve().parent / relative_path
+    if not data_file.exists():
+        return pd.DataFrame()
+    res = pd.read_csv(data_file).set_index('Service Point')
+    base = res[res['scenario'] == 'baseline']
+    after = res[res['scenario'] == 'ai_suggestions']
+    after = after[after['capacity_kg'] != base.loc[after.index, 'capacity_kg']]
+    return base.loc[after.index].join(after, lsuffix=' (now)', rsuffix=' (after)')
+
+@st.cache_data
+def load_history(relative_path):
+    """
+    Loads the per-period service point metric history (sp_history.parquet).
+    Returns an empty DataFrame when the history has not been generated.
+    """
+    data_file = Path(__file__).resolve().parent / relative_path
+    if not data_file.exists():
+        return pd.DataFrame()
+    return pd.read_parquet(data_file)
+
 # --------------------------------------------------------------------------
 # AI Suggestion Logic
 # --------------------------------------------------------------------------
@@ -401,11 +467,11 @@ def get_ai_suggestions(anomalous_df, all_df):
         caiv = row['CAIv Ratio']
         
         if caiv > 1.2:
-            suggestions[sp_name] = {"text": "High overflow risk. Recommend **adding 2 new containers** to increase capacity.", "icon": "M12 6V18M6 12H18", "color": "green"}
+            suggestions[sp_name] = {"text": "High overflow risk. Recommend **adding 2 new containers** to increase capacity.", "icon": "M12 6V18M6 12H18", "color": "green", "containers": 2}
         elif caiv > 0.9:
-            suggestions[sp_name] = {"text": "High utilization. Recommend **adding 1 new container** to prevent overflows.", "icon": "M12 6V18M6 12H18", "color": "green"}
+            suggestions[sp_name] = {"text": "High utilization. Recommend **adding 1 new container** to prevent overflows.", "icon": "M12 6V18M6 12H18", "color": "green", "containers": 1}
         elif caiv < 0.3:
-            suggestions[sp_name] = {"text": "Low utilization. Recommend **removing 1 container** to optimize costs.", "icon": "M18 12H6", "color": "blue"}
+            suggestions[sp_name] = {"text": "Low utilization. Recommend **removing 1 container** to optimize costs.", "icon": "M18 12H6", "color": "blue", "containers": -1}
         else:
             rebalance_candidates.append(row)
 
@@ -417,14 +483,14 @@ def get_ai_suggestions(anomalous_df, all_df):
         sp_name = row['Service Point']
         # The top 2 get the "add 1 container" suggestion
         if i < 2:
-            suggestions[sp_name] = {"text": "High utilization. Recommend **adding 1 new container** to prevent overflows.", "icon": "M12 6V18M6 12H18", "color": "green"}
+            suggestions[sp_name] = {"text": "High utilization. Recommend **adding 1 new container** to prevent overflows.", "icon": "M12 6V18M6 12H18", "color": "green", "containers": 1}
         else:
             # The rest get the rebalance suggestion
             if other_sp_names:
                 random_neighbor = pd.Series(other_sp_names).sample(1).iloc[0]
-                suggestions[sp_name] = {"text": f"Unbalanced fill rate. Suggest **rebalancing load** with nearby point: **{random_neighbor}**.", "icon": "M8 7h12m0 0l-4-4m4 4l-4 4m0 6H4m0 0l4 4m-4-4l4-4", "color": "orange"}
+                suggestions[sp_name] = {"text": f"Unbalanced fill rate. Suggest **rebalancing load** with nearby point: **{random_neighbor}**.", "icon": "M8 7h12m0 0l-4-4m4 4l-4 4m0 6H4m0 0l4 4m-4-4l4-4", "color": "orange", "containers": 0}
             else:
-                suggestions[sp_name] = {"text": "Unbalanced fill rate. Consider adjusting service frequency.", "icon": "M8 7h12m0 0l-4-4m4 4l-4 4m0 6H4m0 0l4 4m-4-4l4-4", "color": "orange"}
+                suggestions[sp_name] = {"text": "Unbalanced fill rate. Consider adjusting service frequency.", "icon": "M8 7h12m0 0l-4-4m4 4l-4 4m0 6H4m0 0l4 4m-4-4l4-4", "color": "orange", "containers": 0}
             
     return suggestions
 
@@ -461,11 +527,28 @@ def main():
         </div>
     """, unsafe_allow_html=True)
 
+    # --- Contamination Slider ---
+    score_index = load_score_index("../output/score_index.npz")
+    anomalous_visits = None
+    # the index is only valid for the sp_metrics it was written with
+    # (sp_sketch.py rewrites sp_metrics.csv without it)
+    if (score_index is not None and 'sp_names' in score_index
+            and np.array_equal(score_index['sp_names'],
+                               df['Service Point'].astype(str).to_numpy())):
+        contamination = st.slider(
+            "Contamination rate (expected share of anomalies)",
+            min_value=0.005, max_value=0.30, step=0.005,
+            value=min(max(float(score_index['contamination']), 0.005), 0.30),
+            format="%.3f"
+        )
+        df, anomalous_visits = apply_contamination(df, score_index, contamination)
+
     # --- KPI Cards ---
     total_sp = len(df)
     anomalous_sp_count = len(df[df['Anomaly State'] == 'Yes'])
     
-    kpi1, kpi2 = st.columns(2)
+    kpis = st.columns(2 if anomalous_visits is None else 3)
+    kpi1, kpi2 = kpis[0], kpis[1]
     with kpi1:
         st.markdown(f"""
             <div class="kpi-card">
@@ -480,6 +563,14 @@ def main():
                 <div class="kpi-value" style="color: #e74c3c;">{anomalous_sp_count}</div>
             </div>
         """, unsafe_allow_html=True)
+    if anomalous_visits is not None:
+        with kpis[2]:
+            st.markdown(f"""
+                <div class="kpi-card">
+                    <div class="kpi-title">Anomalous Visits</div>
+                    <div class="kpi-value" style="color: #e74c3c;">{anomalous_visits}</div>
+                </div>
+            """, unsafe_allow_html=True)
 
     st.markdown("<br>", unsafe_allow_html=True)
 
@@ -507,6 +598,7 @@ def main():
         if st.session_state.view == 'ai_suggestions':
             anomalous_df = df[df['Anomaly State'] == 'Yes'].copy()
             suggestions = get_ai_suggestions(anomalous_df, df)
+            whatif = load_whatif("../output/whatif_results.csv")
             
             # Ensure there are suggestions to display
             if not suggestions:
@@ -521,6 +613,15 @@ def main():
                     suggestion = suggestions.get(sp_name)
                     if not suggestion: continue
 
+                    # only when the simulated change is the one this card suggests
+                    # (the slider can move points in or out of the top-2 rebalance)
+                    projection = ""
+                    if (sp_name in whatif.index and
+                            whatif.loc[sp_name].get('containers (after)') == suggestion['containers']):
+                        w = whatif.loc[sp_name]
+                        projection = (f"<br><strong>Projected:</strong> CAIv {w['CAIv Ratio (now)']:.2f} → {w['CAIv Ratio (after)']:.2f}"
+                                      f" | VOF {w['VOF % (now)']:.1f}% → {w['VOF % (after)']:.1f}%")
+
                     with cols[i % min(num_suggestions, 3)]:
                         st.markdown(f"""
                             <div class="ai-card">
@@ -533,7 +634,7 @@ def main():
                                         </span>
                                     </div>
                                     <div class="ai-card-metrics">
-                                        <strong>CAIv Ratio:</strong> {row['CAIv Ratio']:.3f} | <strong>Anomaly Score:</strong> {row['Max Anomaly Score']:.3f}
+                                        <strong>CAIv Ratio:</strong> {row['CAIv Ratio']:.3f} | <strong>Anomaly Score:</strong> {row['Max Anomaly Score']:.3f}{projection}
                                     </div>
                                 </div>
                                 <p class="ai-card-suggestion">{suggestion['text'].replace('**', '<strong>').replace('**', '</strong>')}</p>
@@ -566,6 +667,30 @@ def main():
                 use_container_width=True
             )
             
+            # --- Metric Trends Section ---
+            history = load_history("../output/sp_history.parquet")
+            if not history.empty:
+                st.markdown("<br><hr/><br>", unsafe_allow_html=True)
+                st.markdown('<h2 class="section-title">Metric Trends</h2>', unsafe_allow_html=True)
+
+                trend_col1, trend_col2 = st.columns(2)
+                with trend_col1:
+                    sp_choice = st.selectbox("Service Point", df_to_show['Service Point'].tolist())
+                with trend_col2:
+                    metrics = st.multiselect(
+                        "Metrics",
+                        ["CAIv Ratio", "VOF %", "VUR %", "Max Anomaly Score"],
+                        default=["VOF %", "VUR %"]
+                    )
+
+                sp_history = history[history['service_point'] == sp_choice].set_index('period')
+                if metrics and not sp_history.empty:
+                    st.line_chart(sp_history[metrics])
+                    flagged = sp_history.index[sp_history['Anomaly State'] == 'Yes']
+                    if len(flagged):
+                        st.caption(f"Flagged as anomalous in {len(flagged)} of {len(sp_history)} periods "
+                                   f"(first: {flagged[0]:%Y-%m-%d}).")
+
             # --- Metric Explanations Section ---
             st.markdown("<br><hr/><br>", unsafe_allow_html=True)
             st.markdown('<h2 class="section-title">Metric Explanations</h2>', unsafe_allow_html=True)